@@ -17,23 +17,107 @@
 Honeycomb from within your Python application.
 '''
 
+import codecs
 import datetime
+import functools
 import json
-import libhoney
 import os
+import random
 import socket
 import sys
-import types
-
-from requests import Session
 
 import opentelemetry.trace as trace_api
 from opentelemetry.sdk.trace.export import SpanExporter, SpanExportResult
 from opentelemetry.trace.status import StatusCode
 
+try:
+    import orjson  # pylint: disable=import-error
+except ImportError:
+    orjson = None
+else:
+    # Reject datetimes and dataclasses, as the json module does, instead of
+    # letting orjson serialize them natively.
+    _ORJSON_OPTIONS = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS  # pylint: disable=no-member
+
 VERSION = '0.16b0'
 USER_AGENT_ADDITION = 'opentelemetry-exporter-python/%s' % VERSION
 
+# Matches the BatchSpanProcessor's default max_export_batch_size, so that a
+# single export call is shipped to the batch API as a single request.
+MAX_BATCH_SIZE = 512
+
+# Lowercase hex, zero-padded to the W3C trace context widths.
+_format_trace_id = '{:032x}'.format
+_format_span_id = '{:016x}'.format
+_utcfromtimestamp = datetime.datetime.utcfromtimestamp
+
+_STATUS_OK = StatusCode.OK
+
+# Maps the type of a span's parent to a function returning the parent's span
+# id, or to None if that type carries no parent. Subclasses of these types are
+# added on first sight by _register_parent_type.
+_PARENT_SPAN_ID_GETTERS = {
+    type(None): None,
+    trace_api.Span: lambda parent: parent.get_span_context().span_id,
+    trace_api.SpanContext: lambda parent: parent.span_id,
+}
+
+
+@functools.lru_cache(maxsize=1)
+def _uninstrumented_session_class():
+    '''Returns a Session subclass whose request and send methods bypass
+    opentel requests instrumentation, if it has been applied.'''
+    from requests import Session  # pylint: disable=import-outside-toplevel
+
+    methods = {}
+    for func in ['request', 'send']:
+        session_func = getattr(Session, func)
+        if getattr(session_func, "opentelemetry_instrumentation_requests_applied", False):
+            session_func = session_func.__wrapped__  # pylint:disable=no-member
+        methods[func] = session_func
+    return type('_UninstrumentedSession', (Session,), methods)
+
+
+def _register_parent_type(parent_type):
+    '''Resolves and caches the parent span id getter for parent_type.'''
+    getter = None
+    for base in parent_type.__mro__[1:]:
+        if base in _PARENT_SPAN_ID_GETTERS:
+            getter = _PARENT_SPAN_ID_GETTERS[base]
+            break
+    _PARENT_SPAN_ID_GETTERS[parent_type] = getter
+    return getter
+
+
+def _json_line(d):
+    return json.dumps(d) + os.linesep
+
+
+def _orjson_line(d):
+    try:
+        return orjson.dumps(d, option=_ORJSON_OPTIONS).decode() + os.linesep  # pylint: disable=no-member
+    except TypeError:
+        # orjson rejects some values the json module accepts, such as
+        # integers wider than 64 bits. Keep the line close to orjson's.
+        return json.dumps(d, ensure_ascii=False, separators=(',', ':')) + os.linesep
+
+
+def _default_formatter(out):
+    '''Returns _orjson_line if orjson is installed and out can encode any
+    text, or the json module's ASCII-safe _json_line otherwise.'''
+    if orjson is None:
+        return _json_line
+    encoding = getattr(out, 'encoding', None)
+    if encoding is None:
+        # In-memory text streams such as io.StringIO.
+        return _orjson_line
+    try:
+        if codecs.lookup(encoding).name.startswith('utf-'):
+            return _orjson_line
+    except LookupError:
+        pass
+    return _json_line
+
 
 class HoneycombSpanExporter(SpanExporter):
     """Honeycomb span exporter for Opentelemetry.
@@ -49,19 +133,19 @@ class HoneycombSpanExporter(SpanExporter):
         if not service_name:
             service_name = os.environ.get('HONEYCOMB_SERVICE', dataset)
 
+        # libhoney (and requests with it) is only loaded once a network
+        # exporter is created; the console exporter does not need it.
+        import libhoney  # pylint: disable=import-outside-toplevel
+
         transmission_impl = libhoney.transmission.Transmission(
+            max_batch_size=MAX_BATCH_SIZE,
+            block_on_send=False,
             user_agent_addition=USER_AGENT_ADDITION,
             debug=debug,
         )
 
-        # Check for opentel instrumentation and unwrap Session request and send
-        for func in ['request', 'send']:
-            session_func = getattr(Session, func,  None)
-            if getattr(session_func, "opentelemetry_instrumentation_requests_applied", False):
-                session_func = session_func.__wrapped__  # pylint:disable=no-member
-
-            # Bind session function for this object to the non-instrumented version.
-            setattr(transmission_impl.session, func, types.MethodType(session_func, transmission_impl.session))
+        # Keep libhoney's own requests out of any opentel requests instrumentation.
+        transmission_impl.session.__class__ = _uninstrumented_session_class()
 
         self.client = libhoney.Client(
             writekey=writekey,
@@ -75,13 +159,30 @@ class HoneycombSpanExporter(SpanExporter):
         self.client.add_field('meta.local_hostname', socket.gethostname())
 
     def export(self, spans):
-        hny_data = _translate_to_hny(spans)
-        for d in hny_data:
-            start_time = d['start_time']
-            del d['start_time']
-            e = libhoney.Event(data=d, client=self.client)
-            e.created_at = start_time
-            e.send()
+        client = self.client
+        # libhoney.Event.send_presampled makes these checks for every event;
+        # they only depend on the client, so make them once per batch.
+        if not (client.writekey and client.dataset and client.api_host):
+            client.log("Missing writekey, dataset or api_host for Honeycomb. Can't send events.")
+            return SpanExportResult.SUCCESS
+
+        # Like libhoney.Event, start each record from the client's fields and
+        # call its dynamic fields once per record.
+        client_fields = client.fields
+        static_fields = client_fields._data  # pylint: disable=protected-access
+        dyn_fields = list(client_fields._dyn_fields)  # pylint: disable=protected-access
+        sample_rate = client.sample_rate
+        for start_time, d in _translate_to_hny(spans):
+            data = dict(static_fields)
+            for fn in dyn_fields:
+                data[fn.__name__] = fn()
+            data.update(d)
+            ev = _SpanEvent(client, data, _utcfromtimestamp(start_time / 1e9))
+            # Same sampling as libhoney.Event.send.
+            if sample_rate > 1 and random.randint(1, sample_rate) != 1:
+                client.send_dropped_response(ev)
+                continue
+            client.send(ev)
         return SpanExportResult.SUCCESS
 
     def shutdown(self):
@@ -98,91 +199,134 @@ class HoneycombConsoleSpanExporter(SpanExporter):
         self,
         service_name=None,
         out=sys.stdout,
-        formatter=lambda d: json.dumps(d) + os.linesep,
+        formatter=None,
     ):
         self.out = out
-        self.formatter = formatter
+        self.formatter = formatter or _default_formatter(out)
         self.service_name = service_name
 
     def export(self, spans):
-        for d in _translate_to_hny(spans):
-            del d["start_time"]  # trust API log timestamp?
-            self.out.write(self.formatter(d))
+        # Start times are dropped; trust API log timestamp?
+        self.out.write(''.join(self.formatter(d) for _, d in _translate_to_hny(spans)))
         self.out.flush()
         return SpanExportResult.SUCCESS
 
 
+class _SpanEvent:
+    """A translated span record queued directly on libhoney's transmission.
+
+    Provides the parts of libhoney.Event that the transmission reads, without
+    copying the record into a FieldHolder the way Event does.
+    """
+    __slots__ = ('writekey', 'dataset', 'api_host', 'sample_rate', 'created_at', '_data')
+
+    metadata = None
+
+    def __init__(self, client, data, created_at):
+        self.writekey = client.writekey
+        self.dataset = client.dataset
+        self.api_host = client.api_host
+        self.sample_rate = client.sample_rate
+        self.created_at = created_at
+        self._data = data
+
+    def fields(self):
+        return self._data
+
+
 def _translate_to_hny(spans):
-    hny_data = []
-    for span in spans:
-        ctx = span.get_span_context()
-        trace_id = ctx.trace_id
-        span_id = ctx.span_id
-        duration_ns = span.end_time - span.start_time
-        d = {
-            'trace.trace_id': trace_api.format_trace_id(trace_id)[2:],
-            'trace.span_id': trace_api.format_span_id(span_id)[2:],
+    # Yields (start time in nanoseconds since the epoch, event data) pairs.
+    #
+    # Build the fixed per-span fields column by column first, then sweep the
+    # spans again for the parts that vary in shape (parent, attributes, refs
+    # and logs).
+    contexts = [span.get_span_context() for span in spans]
+    # Spans of a batch mostly share a handful of traces, so format each
+    # distinct trace id once. Parents are usually in the same batch too, so
+    # their ids are looked up among the batch's span ids before formatting.
+    formatted_trace_ids = {
+        trace_id: _format_trace_id(trace_id)
+        for trace_id in {ctx.trace_id for ctx in contexts}
+    }
+    trace_ids = [formatted_trace_ids[ctx.trace_id] for ctx in contexts]
+    span_ids = [_format_span_id(ctx.span_id) for ctx in contexts]
+    formatted_span_ids = {ctx.span_id: span_id for ctx, span_id in zip(contexts, span_ids)}
+    spans_data = [
+        {
+            'trace.trace_id': trace_id,
+            'trace.span_id': span_id,
             'name': span.name,
-            'start_time': datetime.datetime.utcfromtimestamp(span.start_time / float(1e9)),
-            'duration_ms': duration_ns / float(1e6),  # nanoseconds to ms
+            'duration_ms': (span.end_time - span.start_time) / 1e6,  # nanoseconds to ms
             'response.status_code': span.status.status_code.value,
             'status.message': span.status.description,
             'span.kind': span.kind.name,  # meta.span_type?
         }
-        if isinstance(span.parent, trace_api.Span):
-            d['trace.parent_id'] = trace_api.format_span_id(span.parent.get_span_context().span_id)[2:]
-        elif isinstance(span.parent, trace_api.SpanContext):
-            d['trace.parent_id'] = trace_api.format_span_id(span.parent.span_id)[2:]
+        for span, trace_id, span_id in zip(spans, trace_ids, span_ids)
+    ]
+
+    # Spans from one provider share a Resource, whose attributes property
+    # returns a fresh copy on every access, so fetch it once per resource.
+    resource = resource_attributes = None
+    for span, d, trace_id, span_id in zip(spans, spans_data, trace_ids, span_ids):
+        parent = span.parent
+        try:
+            get_parent_span_id = _PARENT_SPAN_ID_GETTERS[type(parent)]
+        except KeyError:
+            get_parent_span_id = _register_parent_type(type(parent))
+        if get_parent_span_id is not None:
+            parent_span_id = get_parent_span_id(parent)
+            parent_id = formatted_span_ids.get(parent_span_id)
+            if parent_id is None:
+                parent_id = _format_span_id(parent_span_id)
+            d['trace.parent_id'] = parent_id
         # TODO: use sampling_decision attributes for sample rate.
-        d.update(span.resource.attributes)
+        if span.resource is not resource:
+            resource = span.resource
+            resource_attributes = resource.attributes
+        d.update(resource_attributes)
         d.update(span.attributes)
 
         # Ensure that if Status.Code is not OK, that we set the 'error' tag on the Jaeger span.
-        if span.status.status_code is not StatusCode.OK:
+        if span.status.status_code is not _STATUS_OK:
             d['error'] = True
-        hny_data.extend(_extract_refs_from_span(span))
-        hny_data.extend(_extract_logs_from_span(span))
-        hny_data.append(d)
-    return hny_data
-
-
-def _extract_refs_from_span(span):
-    refs = []
-
-    ctx = span.get_span_context()
-    trace_id = ctx.trace_id
-    p_span_id = ctx.span_id
-    for link in span.links:
-        l_trace_id = link.context.trace_id
-        l_span_id = link.context.span_id
-        ref = {
-            'trace.trace_id': trace_api.format_trace_id(trace_id)[2:],
-            'trace.parent_id': trace_api.format_span_id(p_span_id)[2:],
-            'trace.link.trace_id': trace_api.format_trace_id(l_trace_id)[2:],
-            'trace.link.span_id': trace_api.format_span_id(l_span_id)[2:],
+        yield from _extract_refs_from_span(span, trace_id, span_id)
+        yield from _extract_logs_from_span(span, trace_id, span_id)
+        yield span.start_time, d
+
+
+def _extract_refs_from_span(span, trace_id, p_span_id):
+    links = span.links
+    if not links:
+        return ()
+
+    start_time = span.start_time
+    return [
+        (start_time, {
+            'trace.trace_id': trace_id,
+            'trace.parent_id': p_span_id,
+            'trace.link.trace_id': _format_trace_id(link.context.trace_id),
+            'trace.link.span_id': _format_span_id(link.context.span_id),
             'meta.annotation_type': 'link',
             'ref_type': 0,
-        }
-        ref.update(link.attributes)
-        refs.append(ref)
-    return refs
+            **(link.attributes or {}),
+        })
+        for link in links
+    ]
 
 
-def _extract_logs_from_span(span):
-    logs = []
+def _extract_logs_from_span(span, trace_id, p_span_id):
+    events = span.events
+    if not events:
+        return ()
 
-    ctx = span.get_span_context()
-    trace_id = ctx.trace_id
-    p_span_id = ctx.span_id
-    for event in span.events:
-        ev = {
-            'start_time': datetime.datetime.utcfromtimestamp(event.timestamp / float(1e9)),
+    return [
+        (event.timestamp, {
             'duration_ms': 0,
             'name': event.name,
-            'trace.trace_id': trace_api.format_trace_id(trace_id)[2:],
-            'trace.parent_id': trace_api.format_span_id(p_span_id)[2:],
+            'trace.trace_id': trace_id,
+            'trace.parent_id': p_span_id,
             'meta.annotation_type': 'span_event',
-        }
-        ev.update(event.attributes)
-        logs.append(ev)
-    return logs
+            **event.attributes,
+        })
+        for event in events
+    ]
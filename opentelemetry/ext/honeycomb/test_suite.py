@@ -0,0 +1,211 @@
+# Copyright 2020, Hound Technology Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import gzip
+import io
+import itertools
+import json
+import unittest
+from unittest import mock
+
+from opentelemetry import trace as trace_api
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import SimpleSpanProcessor
+from opentelemetry.sdk.trace.export.in_memory_span_exporter import InMemorySpanExporter
+
+from . import VERSION, HoneycombConsoleSpanExporter, HoneycombSpanExporter
+
+
+def _new_tracer():
+    memory_exporter = InMemorySpanExporter()
+    tracer_provider = TracerProvider()
+    tracer_provider.add_span_processor(SimpleSpanProcessor(memory_exporter))
+    return tracer_provider.get_tracer(__name__), memory_exporter
+
+
+def _console_export(spans):
+    out = io.StringIO()
+    HoneycombConsoleSpanExporter(out=out).export(spans)
+    return [json.loads(line) for line in out.getvalue().splitlines()]
+
+
+def _capture_posts(exporter):
+    posted = []
+
+    def post(url, headers, data, timeout):  # pylint: disable=unused-argument
+        payload = json.loads(gzip.decompress(data))
+        posted.append((url, headers, payload))
+        return mock.Mock(status_code=200, json=lambda: [{'status': 202}] * len(payload))
+
+    exporter.client.xmit.session.post = post
+    return posted
+
+
+class TestHoneycombConsoleSpanExporter(unittest.TestCase):
+    def test_export_span_with_link_and_event(self):
+        tracer, memory_exporter = _new_tracer()
+        with tracer.start_as_current_span('linked_to') as linked_to:
+            pass
+        link = trace_api.Link(linked_to.get_span_context(), {'link.attr': 'l'})
+        bare_link = trace_api.Link(linked_to.get_span_context())
+        with tracer.start_as_current_span('span', links=[link, bare_link]) as span:
+            span.add_event('event', {'event.attr': 'e'})
+
+        records = _console_export(memory_exporter.get_finished_spans()[1:])
+
+        ctx = span.get_span_context()
+        linked_ctx = linked_to.get_span_context()
+        self.assertEqual(len(records), 4)
+        link_record, bare_link_record, event_record, span_record = records
+        self.assertEqual(link_record['meta.annotation_type'], 'link')
+        self.assertEqual(link_record['trace.trace_id'], format(ctx.trace_id, '032x'))
+        self.assertEqual(link_record['trace.parent_id'], format(ctx.span_id, '016x'))
+        self.assertEqual(link_record['trace.link.trace_id'], format(linked_ctx.trace_id, '032x'))
+        self.assertEqual(link_record['trace.link.span_id'], format(linked_ctx.span_id, '016x'))
+        self.assertEqual(link_record['link.attr'], 'l')
+        self.assertEqual(bare_link_record['meta.annotation_type'], 'link')
+        self.assertEqual(bare_link_record['trace.link.span_id'], format(linked_ctx.span_id, '016x'))
+        self.assertNotIn('link.attr', bare_link_record)
+        self.assertEqual(event_record['meta.annotation_type'], 'span_event')
+        self.assertEqual(event_record['name'], 'event')
+        self.assertEqual(event_record['trace.parent_id'], format(ctx.span_id, '016x'))
+        self.assertEqual(event_record['event.attr'], 'e')
+        self.assertEqual(span_record['name'], 'span')
+        self.assertEqual(span_record['trace.span_id'], format(ctx.span_id, '016x'))
+        for record in records:
+            self.assertNotIn('start_time', record)
+
+    def test_ids_are_full_width_hex(self):
+        tracer, memory_exporter = _new_tracer()
+        with tracer.start_as_current_span('parent') as parent:
+            with tracer.start_as_current_span('child') as child:
+                pass
+
+        records = _console_export(memory_exporter.get_finished_spans())
+
+        child_record = next(record for record in records if record['name'] == 'child')
+        ctx = child.get_span_context()
+        parent_ctx = parent.get_span_context()
+        self.assertEqual(len(child_record['trace.trace_id']), 32)
+        self.assertEqual(len(child_record['trace.span_id']), 16)
+        self.assertEqual(len(child_record['trace.parent_id']), 16)
+        self.assertEqual(child_record['trace.trace_id'], format(ctx.trace_id, '032x'))
+        self.assertEqual(child_record['trace.span_id'], format(ctx.span_id, '016x'))
+        self.assertEqual(child_record['trace.parent_id'], format(parent_ctx.span_id, '016x'))
+
+    def test_non_ascii_on_ascii_stream(self):
+        tracer, memory_exporter = _new_tracer()
+        with tracer.start_as_current_span('caf\u00e9'):
+            pass
+
+        raw = io.BytesIO()
+        out = io.TextIOWrapper(raw, encoding='ascii')
+        HoneycombConsoleSpanExporter(out=out).export(memory_exporter.get_finished_spans())
+
+        line = raw.getvalue().decode('ascii')
+        self.assertIn('"name": "caf\\u00e9"', line)
+        self.assertEqual(json.loads(line)['name'], 'caf\u00e9')
+
+
+class TestHoneycombSpanExporter(unittest.TestCase):
+    def test_export_sends_batch_payload(self):
+        tracer, memory_exporter = _new_tracer()
+        span = tracer.start_span('span', attributes={'span.attr': 's'}, start_time=1600000000123456000)
+        span.end(end_time=1600000000623456000)
+
+        exporter = HoneycombSpanExporter(writekey='writekey', dataset='dataset', service_name='service')
+        exporter.client.add_field('client.field', 'c')
+
+        def client_dynamic_field():
+            return 'd'
+        exporter.client.add_dynamic_field(client_dynamic_field)
+
+        posted = _capture_posts(exporter)
+        exporter.export(memory_exporter.get_finished_spans())
+        exporter.shutdown()
+
+        self.assertEqual(len(posted), 1)
+        url, headers, payload = posted[0]
+        self.assertEqual(url, 'https://api.honeycomb.io/1/batch/dataset')
+        self.assertEqual(headers['X-Honeycomb-Team'], 'writekey')
+        self.assertEqual(len(payload), 1)
+        event = payload[0]
+        self.assertEqual(event['time'], '2020-09-13T12:26:40.123456Z')
+        self.assertEqual(event['samplerate'], 1)
+        data = event['data']
+        ctx = span.get_span_context()
+        self.assertEqual(data['name'], 'span')
+        self.assertEqual(data['duration_ms'], 500.0)
+        self.assertEqual(data['trace.trace_id'], format(ctx.trace_id, '032x'))
+        self.assertEqual(data['trace.span_id'], format(ctx.span_id, '016x'))
+        self.assertEqual(data['span.attr'], 's')
+        self.assertEqual(data['service_name'], 'service')
+        self.assertEqual(data['meta.otel_exporter_version'], VERSION)
+        self.assertIn('meta.local_hostname', data)
+        self.assertEqual(data['client.field'], 'c')
+        self.assertEqual(data['client_dynamic_field'], 'd')
+
+    def test_client_events_carry_exporter_fields(self):
+        exporter = HoneycombSpanExporter(writekey='writekey', dataset='dataset', service_name='service')
+
+        fields = exporter.client.new_event().fields()
+        exporter.shutdown()
+
+        self.assertEqual(fields['service_name'], 'service')
+        self.assertEqual(fields['meta.otel_exporter_version'], VERSION)
+        self.assertIn('meta.local_hostname', fields)
+
+    def test_dynamic_fields_are_called_per_record(self):
+        tracer, memory_exporter = _new_tracer()
+        for name in ('one', 'two', 'three'):
+            with tracer.start_as_current_span(name):
+                pass
+
+        exporter = HoneycombSpanExporter(writekey='writekey', dataset='dataset')
+        counter = itertools.count()
+
+        def client_counter():
+            return next(counter)
+        exporter.client.add_dynamic_field(client_counter)
+        posted = _capture_posts(exporter)
+        exporter.export(memory_exporter.get_finished_spans())
+        exporter.shutdown()
+
+        payload = [event for _, _, events in posted for event in events]
+        self.assertEqual(sorted(event['data']['client_counter'] for event in payload), [0, 1, 2])
+
+    def test_sampled_out_records_are_dropped(self):
+        tracer, memory_exporter = _new_tracer()
+        for name in ('kept', 'dropped'):
+            with tracer.start_as_current_span(name):
+                pass
+
+        exporter = HoneycombSpanExporter(writekey='writekey', dataset='dataset')
+        exporter.client.sample_rate = 2
+        posted = _capture_posts(exporter)
+        with mock.patch('random.randint', side_effect=[1, 2]) as randint:
+            exporter.export(memory_exporter.get_finished_spans())
+        responses = exporter.client.responses()
+        exporter.shutdown()
+
+        randint.assert_has_calls([mock.call(1, 2), mock.call(1, 2)])
+        payload = [event for _, _, events in posted for event in events]
+        self.assertEqual(len(payload), 1)
+        self.assertEqual(payload[0]['data']['name'], 'kept')
+        self.assertEqual(payload[0]['samplerate'], 2)
+        self.assertEqual(responses.get_nowait()['error'], 'event dropped due to sampling')
+
+
+if __name__ == '__main__':
+    unittest.main()